@@ -1,83 +1,454 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from quart import Quart, Response, request, jsonify
+from quart_cors import cors
+from flask.json.provider import JSONProvider
 from dotenv import load_dotenv
 from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from openai_queue import OpenAIRequestQueue
+from redis import RedisError
+from requests.adapters import HTTPAdapter
+from functools import lru_cache, wraps
+from operator import itemgetter
+import redis.asyncio as redis
+import asyncio
+import hashlib
+import httpx
+import orjson
 import os
+import re
+import requests
+import threading
+import tiktoken
+import time
 
 load_dotenv()
 
-app = Flask(__name__)
-from flask_cors import CORS
+class ORJSONProvider(JSONProvider):
+    """Sérialise les réponses `jsonify` avec orjson plutôt qu'avec le module `json` standard."""
 
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+    option = orjson.OPT_NON_STR_KEYS
 
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.option).decode()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
-MAX_CHARS = 12000  # Pour rester sous les limites de GPT-4
+    def response(self, *args, **kwargs):
+        # Les octets produits par orjson sont envoyés tels quels, sans aller-retour par `str`
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=self.option), mimetype="application/json")
 
-@app.route('/api/summarize', methods=['POST'])
-def summarize():
-    data = request.get_json()
-    video_id = data.get("videoId")
-    target_lang = data.get("targetLang", "fr")
+app = Quart(__name__)
+app.json = ORJSONProvider(app)
+app = cors(app, allow_origin="*")
+
+# 🔌 Client partagé : les connexions TCP/TLS (HTTP/2) vers OpenAI sont réutilisées entre les requêtes
+# Les réessais sont gérés par la file d'attente (openai_queue.py), pas par le SDK
+aclient = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=50)
+    ),
+    max_retries=0
+)
+
+# 🔌 Sessions HTTP YouTube réutilisées : les connexions TLS survivent d'une récupération à l'autre
+# `YouTubeTranscriptApi` n'est pas thread-safe (il écrit notamment les cookies de consentement dans
+# sa session) : chaque thread d'`asyncio.to_thread` garde sa propre session et sa propre instance
+youtube_local = threading.local()
+youtube_sessions = []
+youtube_sessions_lock = threading.Lock()
+
+# 🗄️ Cache Redis partagé entre les workers et conservé entre les redéploiements
+# Délais courts : un Redis injoignable ou muet devient un simple défaut de cache, pas une requête bloquée
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "0.5"))  # secondes
+redis_client = redis.from_url(
+    os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+    socket_connect_timeout=REDIS_TIMEOUT,
+    socket_timeout=REDIS_TIMEOUT
+)
+
+TRANSCRIPT_CACHE_TTL = 7 * 24 * 3600  # 7 jours pour les transcriptions récupérées
+NEGATIVE_CACHE_TTL = 3600  # 1 heure pour les vidéos sans sous-titres, qui peuvent en gagner plus tard
+LLM_CACHE_TTL = 24 * 3600  # 1 jour pour les réponses OpenAI
+
+MODEL = "gpt-4-turbo"  # ✅ Utilisation du modèle optimisé
+
+# 🆔 Un identifiant YouTube fait exactement 11 caractères parmi [a-zA-Z0-9_-]
+VIDEO_ID_RE = re.compile(r"[a-zA-Z0-9_-]{11}")
+# 🌐 Code de langue court (ex. "fr", "en", "pt-BR") : il sert dans les clés Redis et la requête YouTube
+LANGUAGE_RE = re.compile(r"[a-zA-Z-]{2,10}")
+DEFAULT_LANGUAGE = "fr"
+
+get_text = itemgetter("text")
+
+# ⚡ Corps d'erreur fixes, sérialisés une seule fois : les requêtes invalides ne coûtent aucun encodage JSON
+ERROR_VIDEO_ID_REQUIRED = orjson.dumps({"error": "videoId is required"})
+ERROR_VIDEO_ID_INVALID = orjson.dumps({"error": "videoId is invalid"})
+TRANSCRIPTS_DISABLED_ERROR = "[Transcription désactivée pour cette vidéo]"
+
+# ✂️ Budget de la transcription envoyée à GPT-4, compté en tokens plutôt qu'en caractères
+MAX_TOKENS = int(os.getenv("MAX_TRANSCRIPT_TOKENS", "3000"))
+# Plafond de caractères pour arrêter la concaténation tôt : bien au-delà de ce que MAX_TOKENS peut contenir
+MAX_CHARS = MAX_TOKENS * 8
+TRUNCATION_MARKER = "\n\n[Tronqué à cause de la taille maximale]"
+
+encoding = None  # Encodeur tiktoken du modèle, chargé au démarrage du serveur (voir load_encoding)
+ENCODING_LOAD_TIMEOUT = 30  # secondes
+
+# 🚦 File d'attente OpenAI : concurrence bornée et budgets RPM/TPM respectés
+# La fenêtre glissante est propre à chaque processus : les limites du compte sont réparties
+# entre les WEB_CONCURRENCY workers de l'hôte (exporté par gunicorn.conf.py)
+LLM_MAX_ASYNC = int(os.getenv("LLM_MAX_ASYNC", "8"))
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+llm_queue = OpenAIRequestQueue(
+    aclient,
+    max_requests_per_minute=max(1, int(os.getenv("OPENAI_MAX_RPM", "500")) // WEB_CONCURRENCY),
+    max_tokens_per_minute=max(1, int(os.getenv("OPENAI_MAX_TPM", "30000")) // WEB_CONCURRENCY),
+    max_concurrency=LLM_MAX_ASYNC
+)
+
+# 💬 Prompt renforcé : résumé en bullet points, français uniquement
+SUMMARY_PROMPT = (
+    "Tu es un assistant intelligent. Résume le contenu suivant, qui est une transcription brute d'une vidéo YouTube.\n"
+    "\n"
+    "Ta mission :\n"
+    "- Résume uniquement en français 🇫🇷\n"
+    "- Formate en bullet points clairs avec des titres\n"
+    "- Pas d’introduction, pas de conclusion, pas de traduction en anglais\n"
+    "- Garde uniquement les informations utiles\n"
+    "- Utilise le style Markdown :\n"
+    "  - Exemple :\n"
+    "    - Sujet : Contenu\n"
+    "    - Sujet 2 : Autre contenu\n"
+    "\n"
+    "Voici la transcription :\n"
+    "{transcript}"
+)
+
+SYSTEM_PROMPT = "Tu es un assistant de résumé vidéo YouTube multilingue."
+
+# 🧩 Analyses disponibles : clé de la réponse JSON -> modèle de prompt
+# Chaque modèle garde ses instructions fixes en tête et `{transcript}` tout à la fin :
+# OpenAI peut ainsi réutiliser le préfixe commun via son cache de prompts
+ANALYSES = {
+    "summary": SUMMARY_PROMPT,
+}
+for name, template in ANALYSES.items():
+    # Vérification explicite (un `assert` disparaît sous `python -O`)
+    if not template.endswith("{transcript}"):
+        raise ValueError(f"Le modèle de prompt '{name}' doit se terminer par {{transcript}}")
+
+@app.before_serving
+async def load_encoding():
+    # tiktoken peut devoir télécharger le vocabulaire (requête synchrone, sans timeout) :
+    # on le charge au démarrage, hors de la boucle d'événements, pour qu'un échec empêche
+    # le serveur de démarrer plutôt que de casser chaque requête
+    global encoding
+    encoding = await asyncio.wait_for(asyncio.to_thread(tiktoken.encoding_for_model, MODEL), ENCODING_LOAD_TIMEOUT)
+
+@app.before_serving
+async def start_llm_queue():
+    await llm_queue.start()
+
+@app.after_serving
+async def close_clients():
+    await llm_queue.stop()
+    await aclient.close()
+    await redis_client.aclose()
+    with youtube_sessions_lock:
+        for session in youtube_sessions:
+            session.close()
+        youtube_sessions.clear()
+
+def json_bytes_response(body, status=200):
+    return Response(body, status=status, mimetype="application/json")
+
+def validate_video_id(video_id):
+    return isinstance(video_id, str) and VIDEO_ID_RE.fullmatch(video_id) is not None
+
+def validate_language(target_lang):
+    """Renvoie `target_lang` s'il ressemble à un code de langue, sinon la langue par défaut."""
+    if isinstance(target_lang, str) and LANGUAGE_RE.fullmatch(target_lang):
+        return target_lang
+    return DEFAULT_LANGUAGE
+
+async def cache_get(key):
+    try:
+        return await redis_client.get(key)
+    except RedisError as e:
+        # Le cache est une optimisation : une panne Redis ne doit pas casser l'API
+        app.logger.warning("Lecture du cache Redis impossible (%s) : %s", key, e)
+        return None
+
+async def cache_get_many(*keys):
+    try:
+        return await redis_client.mget(keys)
+    except RedisError as e:
+        app.logger.warning("Lecture du cache Redis impossible (%s) : %s", ", ".join(keys), e)
+        return [None] * len(keys)
+
+async def cache_set(key, ttl, value):
+    try:
+        await redis_client.setex(key, ttl, value)
+    except RedisError as e:
+        app.logger.warning("Écriture du cache Redis impossible (%s) : %s", key, e)
+
+def join_until(entries, max_chars):
+    """Concatène les textes des entrées en s'arrêtant dès que `max_chars` est dépassé : renvoie (texte, tronqué)."""
+    parts = []
+    length = -1  # Pas d'espace avant la première entrée
+    for text in map(get_text, entries):
+        parts.append(text)
+        length += len(text) + 1
+        if length > max_chars:
+            return " ".join(parts)[:max_chars], True
+    return " ".join(parts), False
+
+def truncate_to_tokens(text, max_tokens):
+    """Coupe `text` à exactement `max_tokens` tokens du modèle : renvoie (texte, tronqué)."""
+    # Les sous-titres viennent de l'uploader : un texte comme <|endoftext|> reste du texte ordinaire
+    tokens = encoding.encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text, False
+    return encoding.decode(tokens[:max_tokens]), True
+
+def get_ytt_api():
+    """Instance `YouTubeTranscriptApi` du thread courant, créée au premier usage."""
+    ytt_api = getattr(youtube_local, "ytt_api", None)
+    if ytt_api is None:
+        session = requests.Session()
+        # Un thread ne fait qu'une requête à la fois, vers quelques hôtes YouTube
+        session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=2))
+        with youtube_sessions_lock:
+            youtube_sessions.append(session)
+        ytt_api = youtube_local.ytt_api = YouTubeTranscriptApi(http_client=session)
+    return ytt_api
 
-    if not video_id:
-        return jsonify({"error": "videoId is required"}), 400
+def fetch_raw_transcript(video_id, languages):
+    return get_ytt_api().fetch(video_id, languages=languages).to_raw_data()
+
+async def get_transcript(video_id, target_lang):
+    """Récupère la transcription brute : renvoie (liste d'entrées, None, None) ou (None, message d'erreur, code HTTP)."""
+    key = f"yt:{video_id}:{target_lang}"
+    negative_key = f"{key}:neg"
+    # Un seul aller-retour Redis pour la transcription et le cache négatif
+    cached, negative = await cache_get_many(key, negative_key)
+    if cached is not None:
+        try:
+            return orjson.loads(cached), None, None
+        except orjson.JSONDecodeError:
+            # Entrée corrompue ou d'un ancien format : on la traite comme absente
+            app.logger.warning("Entrée de cache illisible ignorée (%s)", key)
+    if negative is not None:
+        return None, negative.decode(), 200
 
-    transcript_text = ""
     try:
-        transcript_list = YouTubeTranscriptApi.get_transcript(video_id, languages=['en'])
-        transcript_text = " ".join([entry["text"] for entry in transcript_list])
+        # L'API YouTube est synchrone : on l'exécute hors de la boucle d'événements
+        transcript_list = await asyncio.to_thread(fetch_raw_transcript, video_id, ['en'])
     except NoTranscriptFound:
         try:
-            transcript_list = YouTubeTranscriptApi.get_transcript(video_id, languages=[target_lang])
-            transcript_text = " ".join([entry["text"] for entry in transcript_list])
+            transcript_list = await asyncio.to_thread(fetch_raw_transcript, video_id, [target_lang])
         except Exception as fallback_err:
-            return jsonify({
-                "summary": f"[Erreur : aucun sous-titre disponible dans les langues spécifiées. Vérifie que la vidéo contient des sous-titres auto dans la langue '{target_lang}'.]"
-            }), 200
+            error = f"[Erreur : aucun sous-titre disponible dans les langues spécifiées. Vérifie que la vidéo contient des sous-titres auto dans la langue '{target_lang}'.]"
+            if isinstance(fallback_err, (NoTranscriptFound, TranscriptsDisabled)):
+                await cache_set(negative_key, NEGATIVE_CACHE_TTL, error.encode())
+            return None, error, 200
     except TranscriptsDisabled:
-        return jsonify({"summary": "[Transcription désactivée pour cette vidéo]"}), 200
+        error = TRANSCRIPTS_DISABLED_ERROR
+        await cache_set(negative_key, NEGATIVE_CACHE_TTL, error.encode())
+        return None, error, 200
     except Exception as e:
-        return jsonify({"summary": f"[Erreur technique lors de l’extraction : {str(e)}]"}), 500
+        return None, f"[Erreur technique lors de l’extraction : {str(e)}]", 500
+
+    await cache_set(key, TRANSCRIPT_CACHE_TTL, orjson.dumps(transcript_list))
+    return transcript_list, None, None
+
+async def fetch_transcript(video_id, target_lang):
+    """Récupère la transcription tronquée : renvoie (texte, None, None) ou (None, message d'erreur, code HTTP)."""
+    transcript_list, error, status = await get_transcript(video_id, target_lang)
+    if error:
+        return None, error, status
+
+    transcript_text, truncated = join_until(transcript_list, MAX_CHARS)
+    transcript_text, token_truncated = truncate_to_tokens(transcript_text, MAX_TOKENS)
 
     # ✂️ Limite de taille
-    if len(transcript_text) > MAX_CHARS:
-        transcript_text = transcript_text[:MAX_CHARS]
-        transcript_text += "\n\n[Tronqué à cause de la taille maximale]"
-
-    # 💬 Prompt renforcé : résumé en bullet points, français uniquement
-    prompt = f"""
-    Tu es un assistant intelligent. Résume le contenu suivant, qui est une transcription brute d'une vidéo YouTube.
-
-    Ta mission :
-    - Résume uniquement en français 🇫🇷
-    - Formate en bullet points clairs avec des titres
-    - Pas d’introduction, pas de conclusion, pas de traduction en anglais
-    - Garde uniquement les informations utiles
-    - Utilise le style Markdown :
-      - Exemple :
-        - Sujet : Contenu
-        - Sujet 2 : Autre contenu
-
-    Voici la transcription :
-    {transcript_text}
+    if truncated or token_truncated:
+        transcript_text += TRUNCATION_MARKER
+
+    return transcript_text, None, None
+
+def llm_cache_key(prompt):
+    # 🗄️ Même modèle + même prompt = même réponse : on évite de repayer l'appel OpenAI
+    return "llm:" + hashlib.sha256((MODEL + SYSTEM_PROMPT + prompt).encode()).hexdigest()
+
+def chat_request(prompt, **kwargs):
+    """Arguments de `chat.completions.create`, communs au mode bufferisé et au streaming."""
+    if kwargs.get("stream"):
+        # En streaming, l'usage (dont les tokens en cache) n'arrive que dans un dernier morceau, sur demande
+        kwargs.setdefault("stream_options", {"include_usage": True})
+    return dict(
+        model=MODEL,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        **kwargs
+    )
+
+def log_prompt_cache_usage(usage):
+    # 📊 Part du prompt servie par le cache de préfixes d'OpenAI
+    details = getattr(usage, "prompt_tokens_details", None) if usage else None
+    if details is not None:
+        app.logger.debug("Tokens de prompt : %s, dont %s en cache", usage.prompt_tokens, details.cached_tokens or 0)
+
+async def complete(prompt):
+    key = llm_cache_key(prompt)
+    cached = await cache_get(key)
+    if cached is not None:
+        return cached.decode()
+
+    response = await llm_queue.submit(**chat_request(prompt))
+    log_prompt_cache_usage(response.usage)
+    content = response.choices[0].message.content
+    await cache_set(key, LLM_CACHE_TTL, content.encode())
+    return content
+
+async def complete_stream(prompt):
+    """Variante de `complete` qui renvoie la réponse morceau par morceau, dès qu'OpenAI la produit."""
+    key = llm_cache_key(prompt)
+    cached = await cache_get(key)
+    if cached is not None:
+        yield cached.decode()
+        return
+
+    parts = []
+    # La file rend la main dès l'ouverture du flux : le 429 éventuel arrive à ce moment-là
+    stream = await llm_queue.submit(**chat_request(prompt, stream=True))
+    # Fermer le flux si le client SSE se déconnecte : sinon OpenAI continue de générer (et de facturer)
+    async with stream:
+        async for chunk in stream:
+            if chunk.usage is not None:
+                log_prompt_cache_usage(chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+    # Seule une réponse complète est mise en cache
+    await cache_set(key, LLM_CACHE_TTL, "".join(parts).encode())
+
+def sse_event(payload, event=None):
+    # Le contenu est encodé en JSON : les retours à la ligne du Markdown ne cassent pas le format SSE
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {orjson.dumps(payload).decode()}\n\n"
+
+def sse_response(prompt, metadata):
+    """Diffuse la complétion en Server-Sent Events, puis les métadonnées dans un dernier événement `done`."""
+    async def generate():
+        try:
+            async for delta in complete_stream(prompt):
+                yield sse_event({"content": delta})
+        except Exception as e:
+            yield sse_event({"error": f"Erreur OpenAI: {str(e)}"}, event="error")
+            return
+        yield sse_event(metadata, event="done")
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Désactive la mise en tampon des proxys nginx
+    response.timeout = None  # Une génération GPT-4 peut dépasser le RESPONSE_TIMEOUT par défaut de Quart
+    return response
+
+def needs_transcript(error_key):
+    """Valide `videoId`/`targetLang` et récupère la transcription avant d'appeler la vue.
+
+    La vue reçoit `(data, video_id, target_lang, transcript_text)`. Les erreurs d'extraction
+    sont renvoyées sous la clé `error_key`, pour garder le format de réponse de chaque endpoint.
     """
+    def decorator(view):
+        # Seule erreur d'extraction au message fixe : son corps est construit une fois par endpoint
+        transcripts_disabled_body = orjson.dumps({error_key: TRANSCRIPTS_DISABLED_ERROR})
+
+        @wraps(view)
+        async def wrapper():
+            data = await request.get_json(silent=True)
+            # Un corps JSON valide peut aussi être une liste ou un nombre
+            if not isinstance(data, dict):
+                data = {}
+            video_id = data.get("videoId")
+            target_lang = validate_language(data.get("targetLang"))
+
+            if not video_id:
+                return json_bytes_response(ERROR_VIDEO_ID_REQUIRED, 400)
+            if not validate_video_id(video_id):
+                return json_bytes_response(ERROR_VIDEO_ID_INVALID, 400)
+
+            transcript_text, error, status = await fetch_transcript(video_id, target_lang)
+            if error == TRANSCRIPTS_DISABLED_ERROR:
+                return json_bytes_response(transcripts_disabled_body, status)
+            if error:
+                return jsonify({error_key: error}), status
+
+            return await view(data, video_id, target_lang, transcript_text)
+        return wrapper
+    return decorator
+
+@app.route('/api/summarize', methods=['POST'])
+@needs_transcript("summary")
+async def summarize(data, video_id, target_lang, transcript_text):
+    prompt = SUMMARY_PROMPT.format_map({"transcript": transcript_text})
+
+    # 📡 Avec "stream": true, le résumé est envoyé au fil de l'eau en Server-Sent Events
+    if data.get("stream"):
+        return sse_response(prompt, {"videoId": video_id, "targetLang": target_lang})
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4-turbo",  # ✅ Utilisation du modèle optimisé
-            messages=[
-                {"role": "system", "content": "Tu es un assistant de résumé vidéo YouTube multilingue."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        summary = response.choices[0].message.content
+        summary = await complete(prompt)
         return jsonify({"summary": summary})
     except Exception as e:
         return jsonify({"error": f"Erreur OpenAI: {str(e)}"}), 500
 
+@app.route('/api/analyze-all', methods=['POST'])
+@needs_transcript("error")
+async def analyze_all(data, video_id, target_lang, transcript_text):
+    # ⚡ Une seule transcription, partagée par des appels OpenAI lancés en parallèle :
+    # la latence totale est celle de l'appel le plus long
+    prompt_vars = {"transcript": transcript_text}
+    results = await asyncio.gather(
+        *(complete(template.format_map(prompt_vars)) for template in ANALYSES.values()),
+        return_exceptions=True
+    )
+
+    payload = {"videoId": video_id}
+    for name, result in zip(ANALYSES, results):
+        if isinstance(result, Exception):
+            payload[name] = None
+            payload.setdefault("errors", {})[name] = f"Erreur OpenAI: {str(result)}"
+        else:
+            payload[name] = result
+    return jsonify(payload)
+
+@lru_cache(maxsize=1)
+def health_body(second):
+    # Le corps ne change qu'une fois par seconde : inutile de le reformater à chaque sonde
+    return orjson.dumps({"status": "ok", "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(second))})
+
+@app.route('/api/health', methods=['GET'])
+async def health():
+    return json_bytes_response(health_body(int(time.time())))
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    if os.getenv("QUART_ENV") == "development":
+        app.run(debug=True)
+    else:
+        # Un seul processus, qui sert l'objet déjà construit : passer "app:app" réimporterait
+        # ce fichier et créerait une seconde application avec ses propres clients
+        if WEB_CONCURRENCY > 1:
+            raise SystemExit("Plusieurs workers : lancez `gunicorn app:app` (voir gunicorn.conf.py)")
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
@@ -0,0 +1,18 @@
+# Configuration de production : gunicorn gère les processus, uvicorn sert l'application ASGI
+# Lancement : gunicorn app:app
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Les appels GPT-4 peuvent durer plusieurs dizaines de secondes
+timeout = 120
+keepalive = 5
+
+
+def on_starting(server):
+    # Nombre de workers effectif (y compris `gunicorn -w N`), hérité par les workers :
+    # app.py s'en sert pour répartir les budgets OpenAI
+    os.environ["WEB_CONCURRENCY"] = str(server.cfg.workers)
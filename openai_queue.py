@@ -0,0 +1,160 @@
+"""File d'attente des appels OpenAI, qui respecte les budgets RPM/TPM du compte.
+
+Toutes les complétions passent par un nombre fixe de workers : la concurrence est bornée,
+les requêtes et les tokens consommés sur une fenêtre glissante de 60 secondes sont suivis
+pour éviter les 429, et les erreurs transitoires sont réessayées avec un backoff exponentiel.
+"""
+from collections import deque
+from openai import APIConnectionError, InternalServerError, RateLimitError
+import asyncio
+import random
+import time
+
+WINDOW_SECONDS = 60.0
+DEFAULT_COMPLETION_TOKENS = 1000  # Réservé pour la réponse quand `max_tokens` n'est pas précisé
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+
+class UsageTrackingStream:
+    """Enveloppe un flux OpenAI et reporte sur la fenêtre l'usage réel reçu en fin de flux.
+
+    L'usage n'est envoyé que si la requête demande `stream_options={"include_usage": True}` ;
+    à défaut, l'estimation réservée reste comptée.
+    """
+
+    def __init__(self, stream, entry):
+        self._stream = stream
+        self._entry = entry
+
+    async def __aenter__(self):
+        await self._stream.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await self._stream.__aexit__(*exc_info)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        async for chunk in self._stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                self._entry[1] = usage.total_tokens
+            yield chunk
+
+    async def close(self):
+        await self._stream.close()
+
+
+class OpenAIRequestQueue:
+    def __init__(self, client, max_requests_per_minute, max_tokens_per_minute, max_concurrency=8, max_attempts=5):
+        self.client = client
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self._queue = None
+        self._workers = []
+        self._window = deque()  # Entrées [horodatage, tokens] des appels de la dernière minute
+        self._lock = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._lock = asyncio.Lock()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            future.cancel()
+
+    async def submit(self, **kwargs):
+        """Met en file un appel `chat.completions.create(**kwargs)` et attend son résultat."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((kwargs, future))
+        return await future
+
+    async def _worker(self):
+        while True:
+            kwargs, future = await self._queue.get()
+            try:
+                # Le client a pu abandonner la requête pendant l'attente dans la file
+                if future.cancelled():
+                    continue
+                result = await self._call(kwargs)
+                if not future.done():
+                    future.set_result(result)
+                elif isinstance(result, UsageTrackingStream):
+                    # L'appelant est parti pendant l'appel : personne ne lira ce flux,
+                    # il faut le fermer sinon OpenAI continue de générer (et de facturer)
+                    await result.close()
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    async def _call(self, kwargs):
+        estimated_tokens = self._estimate_tokens(kwargs)
+        for attempt in range(1, self.max_attempts + 1):
+            entry = await self._reserve(estimated_tokens)
+            try:
+                response = await self.client.chat.completions.create(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_attempts:
+                    raise
+                await asyncio.sleep(self._retry_delay(e, attempt))
+                continue
+
+            # En streaming, l'usage réel n'est connu qu'au dernier morceau : le flux le reportera
+            if kwargs.get("stream"):
+                return UsageTrackingStream(response, entry)
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                entry[1] = usage.total_tokens
+            return response
+
+    async def _reserve(self, tokens):
+        """Attend qu'il reste assez de budget sur la fenêtre glissante, puis le réserve."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._window and now - self._window[0][0] >= WINDOW_SECONDS:
+                    self._window.popleft()
+
+                used_tokens = sum(entry[1] for entry in self._window)
+                # Fenêtre vide : un prompt plus gros que le budget TPM passe quand même, seul
+                if not self._window or (
+                    len(self._window) < self.max_requests_per_minute
+                    and used_tokens + tokens <= self.max_tokens_per_minute
+                ):
+                    entry = [now, tokens]
+                    self._window.append(entry)
+                    return entry
+
+                await asyncio.sleep(WINDOW_SECONDS - (now - self._window[0][0]))
+
+    def _estimate_tokens(self, kwargs):
+        # Approximation d'environ 4 caractères par token, suffisante pour un budget
+        prompt_chars = sum(len(message["content"]) for message in kwargs.get("messages", []))
+        return prompt_chars // 4 + (kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+    def _retry_delay(self, error, attempt):
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Backoff exponentiel avec gigue, pour éviter que les workers réessaient tous en même temps
+        return min(2 ** attempt, 60) * random.uniform(0.5, 1.5)
@@ -0,0 +1,4 @@
+import os
+
+# AsyncOpenAI refuse d'être instancié sans clé : une valeur factice suffit pour importer l'application
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
@@ -0,0 +1,274 @@
+import asyncio
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+import tiktoken
+from youtube_transcript_api import TranscriptsDisabled
+
+import app
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def entries(*texts):
+    return [{"text": text, "start": 0.0, "duration": 1.0} for text in texts]
+
+
+def test_join_until_keeps_short_transcripts_whole():
+    assert app.join_until(entries("bonjour", "le", "monde"), 100) == ("bonjour le monde", False)
+
+
+def test_join_until_at_exact_budget_is_not_truncated():
+    assert app.join_until(entries("abc", "de"), 6) == ("abc de", False)
+
+
+def test_join_until_stops_once_budget_is_exceeded():
+    consumed = []
+
+    def tracked():
+        for entry in entries("abc", "def", "ghi", "jkl"):
+            consumed.append(entry["text"])
+            yield entry
+
+    assert app.join_until(tracked(), 5) == ("abc d", True)
+    # Les entrées au-delà du budget ne sont jamais lues
+    assert consumed == ["abc", "def"]
+
+
+def test_join_until_empty_transcript():
+    assert app.join_until([], 10) == ("", False)
+
+
+@pytest.mark.parametrize("video_id, valid", [
+    ("dQw4w9WgXcQ", True),
+    ("abc_DEF-123", True),
+    ("short", False),
+    ("dQw4w9WgXcQx", False),
+    ("dQw4w9WgXc!", False),
+    (["dQw4w9WgXcQ"], False),
+    (None, False),
+])
+def test_validate_video_id(video_id, valid):
+    assert app.validate_video_id(video_id) is valid
+
+
+@pytest.mark.parametrize("target_lang, expected", [
+    ("en", "en"),
+    ("pt-BR", "pt-BR"),
+    ("x", "fr"),
+    ("a" * 50, "fr"),
+    ("fr:neg", "fr"),
+    (["en"], "fr"),
+    (None, "fr"),
+])
+def test_validate_language(target_lang, expected):
+    assert app.validate_language(target_lang) == expected
+
+
+@pytest.mark.parametrize("body", [None, [1, 2], "texte", {}, {"videoId": ""}])
+def test_missing_video_id_returns_json_400(body):
+    client = app.app.test_client()
+    response = run(client.post("/api/summarize", json=body))
+    assert response.status_code == 400
+    assert response.mimetype == "application/json"
+    assert run(response.get_json()) == {"error": "videoId is required"}
+
+
+def test_invalid_video_id_returns_json_400():
+    client = app.app.test_client()
+    response = run(client.post("/api/analyze-all", json={"videoId": "pas-valide"}))
+    assert response.status_code == 400
+    assert run(response.get_json()) == {"error": "videoId is invalid"}
+
+
+def test_health():
+    client = app.app.test_client()
+    response = run(client.get("/api/health"))
+    assert response.status_code == 200
+    assert run(response.get_json())["status"] == "ok"
+
+
+def test_sse_event_encodes_newlines_as_json():
+    event = app.sse_event({"content": "- a\n- b"}, event="done")
+    assert event == 'event: done\ndata: {"content":"- a\\n- b"}\n\n'
+
+
+# --- Caches Redis (transcriptions et réponses OpenAI) ---
+
+VIDEO_ID = "dQw4w9WgXcQ"
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = fakeredis.aioredis.FakeRedis()
+    monkeypatch.setattr(app, "redis_client", client)
+    return client
+
+
+@pytest.fixture
+def youtube(monkeypatch):
+    """Remplace YouTube : `outcome` est la transcription renvoyée ou l'exception levée."""
+    fake = SimpleNamespace(calls=[], outcome=entries("bonjour", "le", "monde"))
+
+    def fetch_raw_transcript(video_id, languages):
+        fake.calls.append((video_id, languages))
+        if isinstance(fake.outcome, Exception):
+            raise fake.outcome
+        return fake.outcome
+
+    monkeypatch.setattr(app, "fetch_raw_transcript", fetch_raw_transcript)
+    return fake
+
+
+def test_transcript_is_cached_and_served_in_one_mget(fake_redis, youtube, monkeypatch):
+    assert run(app.get_transcript(VIDEO_ID, "fr")) == (youtube.outcome, None, None)
+    assert 0 < run(fake_redis.ttl(f"yt:{VIDEO_ID}:fr")) <= app.TRANSCRIPT_CACHE_TTL
+
+    mget_calls = []
+    original_mget = fake_redis.mget
+
+    async def spying_mget(*args, **kwargs):
+        mget_calls.append(args)
+        return await original_mget(*args, **kwargs)
+
+    monkeypatch.setattr(fake_redis, "mget", spying_mget)
+    assert run(app.get_transcript(VIDEO_ID, "fr")) == (youtube.outcome, None, None)
+    assert len(youtube.calls) == 1
+    assert len(mget_calls) == 1
+
+
+def test_disabled_transcript_is_cached_negatively(fake_redis, youtube):
+    youtube.outcome = TranscriptsDisabled(VIDEO_ID)
+    expected = (None, app.TRANSCRIPTS_DISABLED_ERROR, 200)
+
+    assert run(app.get_transcript(VIDEO_ID, "fr")) == expected
+    assert run(fake_redis.exists(f"yt:{VIDEO_ID}:fr")) == 0
+    assert 0 < run(fake_redis.ttl(f"yt:{VIDEO_ID}:fr:neg")) <= app.NEGATIVE_CACHE_TTL
+
+    assert run(app.get_transcript(VIDEO_ID, "fr")) == expected
+    assert len(youtube.calls) == 1
+
+
+def test_technical_errors_are_not_cached(fake_redis, youtube):
+    youtube.outcome = RuntimeError("réseau")
+
+    transcript_list, error, status = run(app.get_transcript(VIDEO_ID, "fr"))
+    assert transcript_list is None and status == 500
+    assert run(fake_redis.keys("*")) == []
+
+
+def test_unreadable_cached_transcript_is_a_miss(fake_redis, youtube):
+    run(fake_redis.set(f"yt:{VIDEO_ID}:fr", b"\x80pickle"))
+
+    assert run(app.get_transcript(VIDEO_ID, "fr")) == (youtube.outcome, None, None)
+    assert len(youtube.calls) == 1
+
+
+class FakeQueue:
+    """File OpenAI factice : renvoie `content`, en un bloc ou en flux morceau par morceau."""
+
+    def __init__(self, content):
+        self.content = content
+        self.calls = []
+
+    async def submit(self, **kwargs):
+        self.calls.append(kwargs)
+        if not kwargs.get("stream"):
+            message = SimpleNamespace(content=self.content)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+        chunks = [
+            SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=part))])
+            for part in self.content.split(" ")
+        ]
+        return FakeChunkStream(chunks)
+
+
+class FakeChunkStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return None
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def test_completion_is_served_from_cache(fake_redis, monkeypatch):
+    queue = FakeQueue("- résumé")
+    monkeypatch.setattr(app, "llm_queue", queue)
+
+    assert run(app.complete("prompt")) == "- résumé"
+    assert run(app.complete("prompt")) == "- résumé"
+    assert len(queue.calls) == 1
+    assert run(fake_redis.get(app.llm_cache_key("prompt"))) == "- résumé".encode()
+
+
+def test_only_complete_streams_are_cached(fake_redis, monkeypatch):
+    queue = FakeQueue("a b c")
+    monkeypatch.setattr(app, "llm_queue", queue)
+
+    async def read_first_delta():
+        stream = app.complete_stream("prompt")
+        first = await stream.__anext__()
+        await stream.aclose()  # Le client SSE se déconnecte
+        return first
+
+    async def read_all():
+        return [delta async for delta in app.complete_stream("prompt")]
+
+    assert run(read_first_delta()) == "a"
+    assert run(fake_redis.exists(app.llm_cache_key("prompt"))) == 0
+
+    assert run(read_all()) == ["a", "b", "c"]
+    assert run(fake_redis.get(app.llm_cache_key("prompt"))) == b"abc"
+
+    # Réponse en cache : un seul morceau, sans nouvel appel
+    assert run(read_all()) == ["abc"]
+    assert len(queue.calls) == 2
+
+
+
+# --- Budget en tokens ---
+
+@pytest.fixture
+def byte_encoding(monkeypatch):
+    """Encodeur jouet : un token par octet, plus le token spécial <|endoftext|>."""
+    encoding = tiktoken.Encoding(
+        name="octets",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={"<|endoftext|>": 256}
+    )
+    monkeypatch.setattr(app, "encoding", encoding)
+    return encoding
+
+
+def test_truncate_to_tokens_cuts_at_budget(byte_encoding):
+    assert app.truncate_to_tokens("abcdef", 10) == ("abcdef", False)
+    assert app.truncate_to_tokens("abcdef", 4) == ("abcd", True)
+
+
+def test_truncate_to_tokens_treats_special_tokens_as_text(byte_encoding):
+    text = "avant <|endoftext|> après"
+    assert app.truncate_to_tokens(text, 1000) == (text, False)
+    assert app.truncate_to_tokens(text, 9) == ("avant <|e", True)
+
+
+def test_fetch_transcript_applies_token_budget_and_marker(fake_redis, youtube, byte_encoding, monkeypatch):
+    monkeypatch.setattr(app, "MAX_TOKENS", 8)
+    youtube.outcome = entries("bonjour", "<|endoftext|>", "monde")
+
+    transcript_text, error, status = run(app.fetch_transcript(VIDEO_ID, "fr"))
+    assert error is None
+    assert transcript_text == "bonjour " + app.TRUNCATION_MARKER
+
+    monkeypatch.setattr(app, "MAX_TOKENS", 1000)
+    assert run(app.fetch_transcript(VIDEO_ID, "fr"))[0] == "bonjour <|endoftext|> monde"
@@ -0,0 +1,12 @@
+import app
+
+
+def test_routes_use_the_decorated_views():
+    # `@needs_transcript` applique `@wraps` : la vue d'origine reste accessible
+    assert app.summarize.__wrapped__
+    assert app.analyze_all.__wrapped__
+
+
+def test_single_app_instance_serves_the_api():
+    rules = {rule.rule for rule in app.app.url_map.iter_rules()}
+    assert {"/api/summarize", "/api/analyze-all", "/api/health"} <= rules
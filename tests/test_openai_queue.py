@@ -0,0 +1,210 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import openai_queue
+from openai_queue import OpenAIRequestQueue, UsageTrackingStream
+
+
+def rate_limit_error(retry_after=None):
+    headers = {"retry-after": retry_after} if retry_after is not None else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+class FakeClient:
+    """Client minimal : `chat.completions.create` rejoue les erreurs prévues puis renvoie la réponse."""
+
+    def __init__(self, errors=(), total_tokens=42):
+        self.errors = list(errors)
+        self.total_tokens = total_tokens
+        self.calls = []
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.errors:
+            raise self.errors.pop(0)
+        await asyncio.sleep(0)
+        return SimpleNamespace(content=kwargs["messages"][0]["content"], usage=SimpleNamespace(total_tokens=self.total_tokens))
+
+
+def messages(content):
+    return [{"role": "user", "content": content}]
+
+
+async def with_queue(queue, coro_factory):
+    await queue.start()
+    try:
+        return await coro_factory()
+    finally:
+        await queue.stop()
+
+
+def test_concurrent_submits_all_resolve():
+    client = FakeClient()
+    queue = OpenAIRequestQueue(client, max_requests_per_minute=100, max_tokens_per_minute=10**6, max_concurrency=3)
+
+    async def submit_all():
+        return await asyncio.gather(*(queue.submit(messages=messages(str(i))) for i in range(10)))
+
+    results = asyncio.run(with_queue(queue, submit_all))
+    assert [result.content for result in results] == [str(i) for i in range(10)]
+    assert len(client.calls) == 10
+
+
+def test_rate_limit_is_retried_using_retry_after():
+    client = FakeClient(errors=[rate_limit_error("0")])
+    queue = OpenAIRequestQueue(client, max_requests_per_minute=100, max_tokens_per_minute=10**6)
+
+    result = asyncio.run(with_queue(queue, lambda: queue.submit(messages=messages("x"))))
+    assert result.content == "x"
+    assert len(client.calls) == 2
+
+
+def test_error_is_raised_after_max_attempts():
+    client = FakeClient(errors=[rate_limit_error("0") for _ in range(3)])
+    queue = OpenAIRequestQueue(client, max_requests_per_minute=100, max_tokens_per_minute=10**6, max_attempts=3)
+
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(with_queue(queue, lambda: queue.submit(messages=messages("x"))))
+    assert len(client.calls) == 3
+
+
+def test_non_retryable_error_is_raised_immediately():
+    client = FakeClient(errors=[ValueError("boom")])
+    queue = OpenAIRequestQueue(client, max_requests_per_minute=100, max_tokens_per_minute=10**6)
+
+    with pytest.raises(ValueError):
+        asyncio.run(with_queue(queue, lambda: queue.submit(messages=messages("x"))))
+    assert len(client.calls) == 1
+
+
+def test_actual_usage_replaces_the_estimate():
+    client = FakeClient(total_tokens=7)
+    queue = OpenAIRequestQueue(client, max_requests_per_minute=100, max_tokens_per_minute=10**6)
+
+    asyncio.run(with_queue(queue, lambda: queue.submit(messages=messages("x" * 400))))
+    assert [entry[1] for entry in queue._window] == [7]
+
+
+def test_estimate_counts_prompt_and_completion_budget():
+    queue = OpenAIRequestQueue(FakeClient(), max_requests_per_minute=1, max_tokens_per_minute=1)
+    assert queue._estimate_tokens({"messages": messages("x" * 400)}) == 100 + openai_queue.DEFAULT_COMPLETION_TOKENS
+    assert queue._estimate_tokens({"messages": messages("x" * 400), "max_tokens": 50}) == 150
+
+
+def test_reserve_waits_when_request_budget_is_spent(monkeypatch):
+    clock = [1000.0]
+    sleeps = []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+        clock[0] += delay
+
+    monkeypatch.setattr(openai_queue.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(openai_queue.asyncio, "sleep", fake_sleep)
+    queue = OpenAIRequestQueue(FakeClient(), max_requests_per_minute=2, max_tokens_per_minute=10**6)
+
+    async def reserve_three():
+        queue._lock = asyncio.Lock()
+        for _ in range(3):
+            await queue._reserve(10)
+
+    asyncio.run(reserve_three())
+    # La troisième réservation attend que la première sorte de la fenêtre de 60 s
+    assert sleeps == [openai_queue.WINDOW_SECONDS]
+    assert len(queue._window) == 1
+
+
+def test_oversized_request_passes_alone_in_an_empty_window():
+    queue = OpenAIRequestQueue(FakeClient(), max_requests_per_minute=10, max_tokens_per_minute=100)
+
+    async def reserve():
+        queue._lock = asyncio.Lock()
+        return await queue._reserve(1000)
+
+    assert asyncio.run(reserve())[1] == 1000
+
+
+def test_retry_delay_prefers_retry_after_header():
+    queue = OpenAIRequestQueue(FakeClient(), max_requests_per_minute=1, max_tokens_per_minute=1)
+    assert queue._retry_delay(rate_limit_error("3"), attempt=1) == 3.0
+
+
+def test_retry_delay_falls_back_to_jittered_backoff():
+    queue = OpenAIRequestQueue(FakeClient(), max_requests_per_minute=1, max_tokens_per_minute=1)
+    for attempt in range(1, 8):
+        base = min(2 ** attempt, 60)
+        assert base * 0.5 <= queue._retry_delay(rate_limit_error(), attempt) <= base * 1.5
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.closed = True
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def close(self):
+        self.closed = True
+
+
+def test_usage_tracking_stream_records_final_usage_and_closes():
+    chunks = [SimpleNamespace(usage=None), SimpleNamespace(usage=SimpleNamespace(total_tokens=12))]
+    fake = FakeStream(chunks)
+    entry = [0.0, 1000]
+
+    async def consume():
+        async with UsageTrackingStream(fake, entry) as stream:
+            return [chunk async for chunk in stream]
+
+    assert asyncio.run(consume()) == chunks
+    assert entry[1] == 12
+    assert fake.closed
+
+
+def test_stream_opened_after_caller_left_is_closed():
+    opened = []
+    release = None
+
+    class StreamingClient(FakeClient):
+        async def create(self, **kwargs):
+            await release.wait()
+            stream = FakeStream([])
+            opened.append(stream)
+            return stream
+
+    queue = OpenAIRequestQueue(StreamingClient(), max_requests_per_minute=100, max_tokens_per_minute=10**6)
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        await queue.start()
+        try:
+            caller = asyncio.create_task(queue.submit(messages=messages("x"), stream=True))
+            await asyncio.sleep(0.01)  # Le worker est bloqué dans `create`
+            caller.cancel()  # Le client SSE se déconnecte pendant l'ouverture du flux
+            await asyncio.gather(caller, return_exceptions=True)
+            release.set()
+            await queue._queue.join()
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
+    assert len(opened) == 1
+    assert opened[0].closed